@@ -1,17 +1,34 @@
+import asyncio
+import contextlib
+import errno
+import functools
+import heapq
+import hmac
+import itertools
 import os
 import shutil
-import subprocess
+import stat
+import tempfile
+import time
 import uuid
+from collections import OrderedDict
 from pathlib import Path
 from typing import Optional
 
 from fastapi import FastAPI, HTTPException, Header
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, ORJSONResponse
 from pydantic import BaseModel
+from starlette.background import BackgroundTask
 import logging
 
+try:
+    import libarchive  # libarchive-c: in-process extraction, no fork/exec per request
+except ImportError:
+    libarchive = None
+
 # ---- Logging ----
 logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+log = logging.getLogger("sevenzip_api")
 
 # ---- Token loading with file > env > default fallback ----
 def get_api_token(default="changeme") -> str:
@@ -23,9 +40,9 @@ def get_api_token(default="changeme") -> str:
             if token:
                 return token
             else:
-                logging.warning("API_TOKEN_FILE is empty: %s", token_path)
+                log.warning("API_TOKEN_FILE is empty: %s", token_path)
         except Exception as e:
-            logging.warning("Failed to read API_TOKEN_FILE %s: %s", token_path, e)
+            log.warning("Failed to read API_TOKEN_FILE %s: %s", token_path, e)
 
     token = os.getenv("API_TOKEN")
     if token:
@@ -37,46 +54,155 @@ API_TOKEN = get_api_token()
 if API_TOKEN == "changeme":
     raise RuntimeError("API token not configured")
 
+# Expected Authorization header, built once instead of per request
+_EXPECTED_AUTH = f"Bearer {API_TOKEN}".encode()
+
 BASE_DIR = Path(os.environ.get("BASE_DIR", "/data")).resolve()
 OUT_DIR = Path(os.environ.get("OUT_DIR", "/output")).resolve()
 OUT_DIR.mkdir(parents=True, exist_ok=True)
 
-app = FastAPI(title="7zip API", version="1.0.0")
+def _dir_prefix(base: str) -> str:
+    """`base` with exactly one trailing separator ("/" stays "/")."""
+    return base if base.endswith(os.sep) else base + os.sep
+
+# Containment checks compare plain strings against these; ~10x cheaper than
+# Path.is_relative_to, which builds part lists on every call.
+_BASE_STR = os.fspath(BASE_DIR)
+_BASE_PREFIX = _dir_prefix(_BASE_STR)
+_OUT_STR = os.fspath(OUT_DIR)
+_OUT_PREFIX = _dir_prefix(_OUT_STR)
+
+_RESOLVE_TTL = 60  # seconds a cached BASE_DIR path resolution stays valid
+
+# Bigger chunks for shutil's copy loops (default 64 KiB) when a move has to copy
+shutil.COPY_BUFSIZE = 4 * 1024 * 1024
+
+# CPUs this process may actually run on (honours cpusets, e.g. docker --cpuset-cpus)
+CPU_COUNT = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+
+# Compression threads handed to 7z via -mmt (0/unset = one per usable CPU)
+SEVENZ_THREADS = int(os.environ.get("SEVENZ_THREADS", "0")) or CPU_COUNT
+
+# Extensions whose payload is already compressed; deflating them again is wasted CPU.
+_INCOMPRESSIBLE_EXTS = frozenset({
+    ".zip", ".7z", ".gz", ".xz", ".zst", ".png", ".jpg", ".jpeg",
+    ".mp4", ".mkv", ".onnx", ".parquet",
+})
+_AUTO_STORE_SAMPLE = 1000   # files inspected by auto_store
+_AUTO_STORE_RATIO = 0.7     # fraction of incompressible files that switches to store
+_STREAM_CHUNK = 1024 * 1024  # bytes per read when streaming 7z stdout
+# Archive layout probes, (path, mtime_ns, size) -> single top-level dir name (LRU)
+_ROOT_CACHE: "OrderedDict[tuple, str]" = OrderedDict()
+_ROOT_CACHE_SIZE = 512
+_ROOT_PROBE_MIN_SIZE = 64 * 1024  # smaller archives are not worth a layout probe
+_WILDCARD_CHARS = frozenset("*?")  # 7z matches these in archive names, even from list files
+
+# Keep 7z quiet: no messages on stdout (-bso0), no progress indicator (-bsp0),
+# no per-file log lines (-bb0). Errors still go to stderr.
+_SEVENZ_QUIET = ["-bso0", "-bsp0", "-bb0"]
+
+# Every 7z run (a, x) already uses every core, so cap how many run at once across
+# all endpoints. Short listings (7z l) are not gated.
+SEVENZ_CONCURRENCY = int(os.environ.get("SEVENZ_CONCURRENCY", "0")) or min(CPU_COUNT, 4)
+_SEVENZ_SEM = asyncio.Semaphore(SEVENZ_CONCURRENCY)
+
+# Fire-and-forget cleanup tasks; referenced here so they aren't garbage collected
+_BACKGROUND: set = set()
+
+# Destination folders an in-flight request is extracting into (see _overwrite_policy)
+_CLAIMED: set = set()
+
+# orjson encodes the JSON manifests in C, several times faster than json.dumps
+app = FastAPI(title="7zip API", version="1.0.0", default_response_class=ORJSONResponse)
 
 
 # ---- Helpers ----
 def _require_auth(authorization: Optional[str]):
     if not API_TOKEN:
         return
-    if authorization != f"Bearer {API_TOKEN}":
+    # Constant-time compare so the token can't be guessed byte by byte via timing
+    if authorization is None or not hmac.compare_digest(authorization.encode(), _EXPECTED_AUTH):
         raise HTTPException(status_code=401, detail="Unauthorized")
 
+def _inside(base: str, prefix: str, p) -> bool:
+    """True if normalized path `p` is `base` or lies below it (prefix = _dir_prefix(base))."""
+    s = os.fspath(p)
+    return s == base or s.startswith(prefix)
+
+@functools.lru_cache(maxsize=2048)
+def _resolve_under_base(p: str, _epoch: int) -> Path:
+    """
+    Cached resolve() of a request path against BASE_DIR. `_epoch` changes every
+    _RESOLVE_TTL seconds, so entries (and any symlink changes) expire by themselves.
+    """
+    cand = Path(p)
+    return (BASE_DIR / cand).resolve() if not cand.is_absolute() else cand.resolve()
+
 def _safe_path(p: str) -> Path:
     """
     Resolve a path safely under BASE_DIR.
     - Relative input is treated as relative to BASE_DIR.
     - Absolute input must still resolve under BASE_DIR.
+    Only the parent folder comes from the cache. The last component is checked
+    fresh every time, so a target swapped for a symlink can't hide behind a
+    stale entry.
     """
-    cand = Path(p)
-    rp = (BASE_DIR / cand).resolve() if not cand.is_absolute() else cand.resolve()
-    if not str(rp).startswith(str(BASE_DIR) + os.sep) and str(rp) != str(BASE_DIR):
+    head, tail = os.path.split(p.rstrip(os.sep) or p)
+    if tail in ("", os.curdir, os.pardir):
+        rp = (BASE_DIR / p).resolve()  # "/", ".", "..": nothing worth caching
+    else:
+        rp = _resolve_under_base(head or os.curdir, int(time.monotonic() // _RESOLVE_TTL)) / tail
+        if os.path.islink(rp):
+            rp = rp.resolve()
+    if not _inside(_BASE_STR, _BASE_PREFIX, rp):
         raise HTTPException(status_code=400, detail=f"Path outside allowed base: {rp}")
     return rp
 
-def _safe_out(name: str) -> Path:
+def _download_name(name: str) -> str:
+    """File name a built archive is offered under; only the last path component counts."""
+    name = os.path.basename(os.path.normpath(name))
+    return "archive.zip" if name in ("", os.curdir, os.pardir) else name
+
+def _stat(p: Path) -> Optional[os.stat_result]:
+    """One stat() call; None if the path does not exist (or is unreachable)."""
+    try:
+        return os.stat(p)
+    except OSError:
+        return None
+
+def _safe_archive(folder: str, name: str) -> tuple[Path, os.stat_result]:
     """
-    Ensure an output path remains within OUT_DIR and prevent traversal.
-    Creates parent directories if needed.
+    Resolve `name` inside `folder` (both relative to BASE_DIR) with a single
+    resolve() and check it is an existing file; returns the path and its stat.
+    The folder itself is only looked at to produce a precise 404 when the
+    archive is missing.
     """
-    out = (OUT_DIR / name).resolve()
-    if not str(out).startswith(str(OUT_DIR) + os.sep) and str(out) != str(OUT_DIR):
-        raise HTTPException(status_code=400, detail=f"Invalid output name: {out}")
-    out.parent.mkdir(parents=True, exist_ok=True)
-    return out
+    archive_path = _safe_path(os.path.join(folder, name))
+    st = _stat(archive_path)
+    if st is None or not stat.S_ISREG(st.st_mode):
+        src_folder = _safe_path(folder)
+        st = _stat(src_folder)
+        if st is None or not stat.S_ISDIR(st.st_mode):
+            raise HTTPException(status_code=404, detail=f"Source folder not found: {src_folder}")
+        raise HTTPException(status_code=404, detail=f"Archive file not found: {archive_path}")
+    return archive_path, st
 
-def _ensure_under_out(p: Path):
-    if not str(p).startswith(str(OUT_DIR) + os.sep) and str(p) != str(OUT_DIR):
-        raise HTTPException(status_code=400, detail=f"Destination escapes OUT_DIR: {p}")
+def _safe_dest(name: str) -> Path:
+    """
+    Map a destination folder name to a path under OUT_DIR.
+    A plain single-level name is joined without touching the filesystem; anything
+    nested (or "." / "..") is resolved once, since it may pass through symlinks.
+    """
+    rel = os.path.normpath(name)
+    dest = OUT_DIR / rel
+    if os.sep in rel or rel in (os.curdir, os.pardir):
+        dest = dest.resolve()
+    if not _inside(_OUT_STR, _OUT_PREFIX, dest):
+        raise HTTPException(status_code=400, detail=f"Destination escapes OUT_DIR: {dest}")
+    if os.fspath(dest) == _OUT_STR:
+        # The overwrite policy would move OUT_DIR itself aside.
+        raise HTTPException(status_code=400, detail="Destination must be a folder inside OUT_DIR")
+    return dest
 
 def _unique_path(base: Path) -> Path:
     """Return a unique path by appending a short suffix if the path exists."""
@@ -85,24 +211,433 @@ def _unique_path(base: Path) -> Path:
     suffix = "-" + uuid.uuid4().hex[:6]
     return base.with_name(base.name + suffix)
 
-def _run_7z(args: list, cwd: Optional[Path] = None):
-    try:
-        res = subprocess.run(
-            args,
+def _mostly_incompressible(src: Path, recursive: bool = True,
+                           exts: frozenset = _INCOMPRESSIBLE_EXTS) -> bool:
+    """
+    Sample up to _AUTO_STORE_SAMPLE files under src and report whether most of
+    them already carry compressed payloads (by extension, see `exts`).
+    """
+    total = hits = 0
+    stack = [str(src)]
+    while stack and total < _AUTO_STORE_SAMPLE:
+        try:
+            with os.scandir(stack.pop()) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        if recursive:
+                            stack.append(entry.path)
+                        continue
+                    total += 1
+                    if os.path.splitext(entry.name)[1].lower() in exts:
+                        hits += 1
+                    if total >= _AUTO_STORE_SAMPLE:
+                        break
+        except OSError:
+            continue  # unreadable or vanished directory: it's only a sample
+    return total > 0 and hits / total > _AUTO_STORE_RATIO
+
+async def _run_7z(args: list, cwd: Optional[Path] = None):
+    """
+    Run 7z without blocking the event loop; stdout is discarded and stderr is only
+    decoded when 7z fails. Raises HTTP 500 on a non-zero exit.
+
+    stderr is watched line by line: the first "ERROR:" line (wrong password,
+    disk full, ...) terminates 7z right away instead of waiting for the whole job.
+    At most SEVENZ_CONCURRENCY of these run at a time.
+    """
+    async with _SEVENZ_SEM:
+        proc = await asyncio.create_subprocess_exec(
+            *args,
             cwd=str(cwd) if cwd else None,
-            check=True,
-            capture_output=True,
-            text=True,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE,
         )
-        if res.stdout:
-            logging.info("7z stdout (trunc): %s", res.stdout[:1000])
-    except subprocess.CalledProcessError as e:
-        logging.error("7z failed. stdout=%s stderr=%s", e.stdout, e.stderr)
+        err_lines = []
+        aborted = False
+        async for line in proc.stderr:
+            err_lines.append(line)
+            if line.startswith(b"ERROR:"):
+                aborted = True
+                proc.terminate()
+                break
+        await proc.wait()
+
+    if aborted or proc.returncode != 0:
+        stderr = b"".join(err_lines).decode("utf-8", "replace").strip()
+        log.error("7z failed (rc=%s). stderr=%s", proc.returncode, stderr)
         raise HTTPException(
             status_code=500,
-            detail=f"7z failed: {(e.stderr or e.stdout or str(e)).strip()}",
+            detail=f"7z failed: {stderr or f'exit code {proc.returncode}'}",
         )
 
+def _replace_with(target: str, make):
+    """Run make(target), first removing a file or link already sitting at target."""
+    try:
+        make(target)
+    except FileExistsError:
+        os.unlink(target)
+        make(target)
+
+def _extract_with_libarchive(archive_path: Path, dest: Path, root: Optional[Path] = None):
+    """
+    Extract archive_path into dest in-process via libarchive (GIL released while
+    decoding). Directories, regular files, hardlinks and symlinks are written with
+    their permission bits and mtimes; devices, fifos, and entries or link targets
+    that would land outside `root` (default: dest) are skipped.
+
+    Symlinks must point strictly below root (the root itself may be moved into
+    place later). They are created after everything else, so no entry is ever
+    written through one, and are then checked as resolved on disk: a chain of
+    links that only escapes once all of them exist is removed again.
+    """
+    dest_str = os.fspath(dest)
+    root_str = os.fspath(root) if root is not None else dest_str
+    root_prefix = _dir_prefix(root_str)
+    real_root = os.path.realpath(root_str)
+    real_prefix = _dir_prefix(real_root)
+    dirs = []   # (path, perm, mtime), applied last: writing children bumps a dir's mtime
+    links = []  # (path, name, link target)
+    with libarchive.file_reader(str(archive_path)) as reader:
+        for entry in reader:
+            target = os.path.normpath(os.path.join(dest, entry.pathname))
+            if target == dest_str or not _inside(root_str, root_prefix, target):
+                log.warning("Skipping entry outside destination: %r", entry.pathname)
+                continue
+            if entry.isdir:
+                os.makedirs(target, exist_ok=True)
+                dirs.append((target, entry.perm, entry.mtime))
+                continue
+            parent = os.path.dirname(target)
+            os.makedirs(parent, exist_ok=True)
+            if entry.issym:
+                link = entry.linkpath
+                resolved = os.path.normpath(os.path.join(parent, link))
+                if (os.path.isabs(link) or resolved == root_str
+                        or not _inside(root_str, root_prefix, resolved)):
+                    log.warning("Skipping symlink outside destination: %r -> %r",
+                                entry.pathname, link)
+                    continue
+                links.append((target, entry.pathname, link))
+            elif entry.islnk:
+                src = os.path.normpath(os.path.join(dest, entry.linkpath))
+                if not _inside(real_root, real_prefix, os.path.realpath(src)):
+                    log.warning("Skipping hardlink outside destination: %r -> %r",
+                                entry.pathname, entry.linkpath)
+                    continue
+                if os.path.islink(src) or not os.path.isfile(src):
+                    # Source was skipped (or is a dir/deferred symlink): os.link would fail.
+                    log.warning("Skipping hardlink to missing entry: %r -> %r",
+                                entry.pathname, entry.linkpath)
+                    continue
+                _replace_with(target, functools.partial(os.link, src))
+            elif entry.isreg:
+                with open(target, "wb") as f:
+                    for block in entry.get_blocks():
+                        f.write(block)
+                # No setuid/setgid/sticky from an untrusted archive.
+                os.chmod(target, entry.perm & 0o777)
+                if entry.mtime is not None:
+                    os.utime(target, (entry.mtime, entry.mtime))
+            else:
+                log.warning("Skipping special entry: %r", entry.pathname)
+    for path, name, link in links:
+        try:
+            _replace_with(path, functools.partial(os.symlink, link))
+        except OSError as e:  # e.g. a directory already sits there
+            log.warning("Skipping symlink %r: %s", name, e)
+    for path, name, link in links:
+        if not os.path.islink(path):
+            continue
+        resolved = os.path.realpath(path)
+        if resolved == real_root or not _inside(real_root, real_prefix, resolved):
+            log.warning("Removing symlink outside destination: %r -> %r", name, link)
+            os.unlink(path)
+    for path, perm, mtime in reversed(dirs):
+        # Owner keeps rwx so the tree can still be replaced or cleaned up later.
+        os.chmod(path, (perm & 0o777) | 0o700)
+        if mtime is not None:
+            os.utime(path, (mtime, mtime))
+
+class _RootProbe:
+    """
+    Fed archive entries one at a time; tracks whether they all live under a
+    single top-level directory so callers can stop reading as soon as they don't.
+    """
+
+    def __init__(self):
+        self.root: Optional[str] = None
+        self.root_is_dir = False
+
+    def add(self, path: str, is_dir: bool) -> bool:
+        """
+        Record an entry; returns False once a second top-level item shows up, or
+        for an absolute / ".." path, whose real location its first segment hides.
+        """
+        path = path.replace("\\", "/")
+        parts = [s for s in path.split("/") if s not in ("", ".")]
+        if path.startswith("/") or ".." in parts:
+            return False
+        return self.add_top(parts[0] if parts else "", is_dir or len(parts) > 1)
+
+    def add_top(self, first: str, is_dir: bool) -> bool:
+        """Like add(), given an entry's first path segment and whether it is a dir."""
+        if not first:
+            return True
+        if self.root is None:
+            self.root = first
+        elif first != self.root:
+            return False
+        self.root_is_dir = self.root_is_dir or is_dir
+        return True
+
+    @property
+    def result(self) -> Optional[str]:
+        """The single top-level directory name, or None (lone file / empty)."""
+        return self.root if self.root_is_dir else None
+
+def _libarchive_root(archive_path: Path) -> Optional[str]:
+    """Single top-level directory via libarchive (headers only, stops early)."""
+    probe = _RootProbe()
+    with libarchive.file_reader(str(archive_path)) as reader:
+        for entry in reader:
+            if not probe.add(entry.pathname, entry.isdir):
+                return None
+    return probe.result
+
+async def _7z_root(archive_path: Path, password: Optional[str] = None) -> Optional[str]:
+    """
+    Single top-level directory via a streamed `7z l -ba -slt`. 7z is killed as
+    soon as a second top-level item shows up, so huge archives are not listed in
+    full. A failing listing yields None and leaves error reporting to extraction.
+    """
+    cmd = ["7z", "l", "-ba", "-slt", "-bsp0", str(archive_path)]
+    if password:
+        cmd.append(f"-p{password}")
+    proc = await asyncio.create_subprocess_exec(
+        *cmd,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.DEVNULL,
+        limit=_STREAM_CHUNK,
+    )
+    # Parse on raw bytes: only the first path segment of each entry is decoded.
+    archive = os.fsencode(archive_path)
+    probe = _RootProbe()
+    single = True
+    first = None
+    is_dir = False
+    try:
+        async for line in proc.stdout:
+            if line.startswith(b"Path = "):
+                if first is not None and not probe.add_top(first, is_dir):
+                    single = False
+                    break
+                path = line[7:].rstrip(b"\r\n")
+                if path == archive:  # archive-level block, not an entry
+                    first = None
+                    continue
+                path = path.replace(b"\\", b"/")
+                parts = [s for s in path.split(b"/") if s not in (b"", b".")]
+                if path.startswith(b"/") or b".." in parts:
+                    single = False
+                    break
+                first = parts[0].decode("utf-8", "replace") if parts else ""
+                is_dir = len(parts) > 1
+            elif line.startswith(b"Folder = +"):
+                is_dir = True
+        else:
+            if first is not None:
+                single = probe.add_top(first, is_dir)
+    finally:
+        if proc.returncode is None and not proc.stdout.at_eof():
+            # Decision made (or we were cancelled): no need to list the rest.
+            proc.kill()
+        while await proc.stdout.read(_STREAM_CHUNK):
+            pass  # drain to EOF, or wait() never returns on a paused pipe
+        rc = await proc.wait()
+    if not single or rc != 0:
+        return None
+    return probe.result
+
+async def _detect_single_root_dir(archive_path: Path, password: Optional[str] = None,
+                                  st: Optional[os.stat_result] = None) -> Optional[str]:
+    """
+    Peek at the archive layout (central directory / headers only) and return the
+    name of its single top-level directory, if it has one.
+
+    Found roots are cached per (path, mtime_ns, size), so re-extracting an
+    unchanged archive skips the listing; any change to the file misses the cache.
+    Negative results are not cached: they are cheap (the listing stops at the
+    second top-level item) and may come from a failed listing.
+    """
+    st = st or _stat(archive_path)
+    key = (str(archive_path), st.st_mtime_ns, st.st_size) if st else None
+    if key in _ROOT_CACHE:
+        _ROOT_CACHE.move_to_end(key)
+        return _ROOT_CACHE[key]
+
+    root = None
+    if libarchive is not None and not password:
+        try:
+            root = await asyncio.to_thread(_libarchive_root, archive_path)
+        except libarchive.ArchiveError as e:
+            log.warning("libarchive could not list %s (%s); using 7z", archive_path, e)
+            root = await _7z_root(archive_path, password)
+    else:
+        root = await _7z_root(archive_path, password)
+
+    if root is not None and key is not None:
+        _ROOT_CACHE[key] = root
+        if len(_ROOT_CACHE) > _ROOT_CACHE_SIZE:
+            _ROOT_CACHE.popitem(last=False)
+    return root
+
+async def _extract_archive(archive_path: Path, dest: Path, password: Optional[str] = None,
+                           root: Optional[Path] = None):
+    """
+    Extract archive_path into dest: in-process via libarchive when possible, else 7z.
+    `root` narrows where libarchive may write (default: dest); 7z strips ".."
+    segments itself.
+    """
+    if libarchive is not None and not password:
+        try:
+            await asyncio.to_thread(_extract_with_libarchive, archive_path, dest, root)
+            return
+        except libarchive.ArchiveError as e:
+            log.warning("libarchive failed on %s (%s); falling back to 7z", archive_path, e)
+            # Start 7z from a clean slate: drop whatever libarchive already wrote
+            # (root is final_dir when dest is its parent; otherwise dest is fresh).
+            await asyncio.to_thread(_empty_dir, root or dest)
+
+    cmd = ["7z", "x", *_SEVENZ_QUIET, str(archive_path), f"-o{str(dest)}", "-y"]
+    if password:
+        cmd.append(f"-p{password}")
+
+    log.info("Running 7z (unzip) with args: %s", cmd)
+    await _run_7z(cmd)
+
+def _in_background(func, *args, **kwargs):
+    """Run func in a thread without awaiting it, whatever happens to the request."""
+    task = asyncio.create_task(asyncio.to_thread(func, *args, **kwargs))
+    _BACKGROUND.add(task)
+    task.add_done_callback(_BACKGROUND.discard)
+
+def _empty_dir(path: Path):
+    """Remove everything inside path, keeping path itself."""
+    try:
+        with os.scandir(path) as it:
+            entries = list(it)
+    except FileNotFoundError:
+        return
+    for e in entries:
+        if e.is_dir(follow_symlinks=False):
+            shutil.rmtree(e.path, ignore_errors=True)
+        else:
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(e.path)
+
+@contextlib.asynccontextmanager
+async def _overwrite_policy(final_dir: Path, overwrite: Optional[str]):
+    """
+    Apply the folder-level overwrite policy and claim the destination: it is
+    created empty (exclusive mkdir, plus _CLAIMED for this process) and yielded,
+    so concurrent requests for the same folder get a 409 or, with "rename",
+    their own folder instead of extracting on top of each other.
+
+    "overwrite" renames the old tree aside (O(1)); a folder another request is
+    still extracting into is never taken over. If the body of the `async with`
+    fails, the claimed folder is removed, or the old tree is renamed back over
+    it; on success the old tree is deleted in the background.
+    """
+    mode = (overwrite or "skip").lower()
+    requested = final_dir
+    requested.parent.mkdir(parents=True, exist_ok=True)
+    trash = None
+    while True:
+        key = os.fspath(final_dir)
+        try:
+            if key in _CLAIMED:
+                raise FileExistsError(errno.EEXIST, "in use by another request", key)
+            os.mkdir(final_dir)
+            break
+        except FileExistsError:
+            if mode == "rename":
+                final_dir = _unique_path(requested)
+            elif mode == "overwrite" and trash is None and key not in _CLAIMED:
+                trash = final_dir.with_name(f".trash-{final_dir.name}-{uuid.uuid4().hex[:6]}")
+                os.rename(final_dir, trash)
+            else:  # skip, or lost a race for the folder
+                if trash is not None:
+                    _in_background(shutil.rmtree, trash, ignore_errors=True)
+                raise HTTPException(status_code=409, detail=f"Destination exists: {final_dir}")
+
+    _CLAIMED.add(key)
+    try:
+        yield final_dir
+    except BaseException:
+        if trash is None:
+            await asyncio.to_thread(shutil.rmtree, final_dir, ignore_errors=True)
+        else:
+            # Renaming over our (emptied) folder keeps the path claimed throughout.
+            await asyncio.to_thread(_empty_dir, final_dir)
+            try:
+                os.rename(trash, final_dir)
+            except OSError as e:
+                log.warning("Could not restore %s from %s (%s); discarding it", final_dir, trash, e)
+                _in_background(shutil.rmtree, trash, ignore_errors=True)
+        raise
+    finally:
+        _CLAIMED.discard(key)
+    if trash is not None:
+        _in_background(shutil.rmtree, trash, ignore_errors=True)
+
+def _write_list_file(lines: list) -> str:
+    """Write a UTF-8 7z list file (one name per line) and return its path."""
+    with tempfile.NamedTemporaryFile("w", encoding="utf-8", suffix=".lst", delete=False) as f:
+        f.write("\n".join(lines) + "\n")
+    return f.name
+
+def _move_into_place(src: Path, dst: Path):
+    """
+    Rename src to dst; if dst sits on another filesystem (e.g. a mount inside
+    OUT_DIR), fall back to a copying move (sendfile on Linux, 4 MiB buffers otherwise).
+    """
+    try:
+        os.replace(src, dst)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        if dst.is_dir():
+            dst.rmdir()  # the claimed, still empty final_dir; shutil.move would nest into it
+        shutil.move(str(src), str(dst))
+
+def _normalize_extraction(temp_dir: Path, final_dir: Path):
+    """
+    Move extracted content from temp_dir to final_dir (an existing, empty folder,
+    which the rename replaces) without an extra nesting level.
+    """
+    # If temp contains exactly one directory, use it as final_dir; else temp itself
+    # becomes final_dir. Both are single renames unless final_dir is on another mount.
+    # Two entries are enough to decide; don't list a huge extraction in full.
+    with os.scandir(temp_dir) as it:
+        entries = list(itertools.islice(it, 2))
+    if len(entries) == 1 and entries[0].is_dir(follow_symlinks=False):
+        # Move that single directory to final_dir (no extra nesting)
+        _move_into_place(Path(entries[0].path), final_dir)
+        temp_dir.rmdir()
+    else:
+        _move_into_place(temp_dir, final_dir)
+
+def _top_level_entries(folder: Path, limit: int = 200) -> list:
+    """
+    First `limit` names (sorted) directly under folder, empty on error.
+    Uses a bounded heap so huge extractions are never fully listed or sorted.
+    """
+    try:
+        with os.scandir(folder) as it:
+            return heapq.nsmallest(limit, (e.name for e in it))
+    except OSError:
+        return []
+
 
 # ---- Schemas ----
 class ZipFolderReq(BaseModel):
@@ -111,6 +646,14 @@ class ZipFolderReq(BaseModel):
     password: Optional[str] = None
     recursive: bool = True
     format: str = "zip"  # "7z" or "zip"
+    level: int = 5              # 0 (store) .. 9 (ultra), maps to -mx
+    threads: Optional[int] = None  # compression threads (default: SEVENZ_THREADS)
+    store_only: bool = False    # store without compression (-mx=0)
+    auto_store: bool = False    # store if the folder is mostly already-compressed files
+    store_extensions: list[str] = []  # extra extensions auto_store treats as incompressible
+    dict_mb: int = 64           # LZMA2 dictionary size in MiB (7z only)
+    solid: bool = True          # solid 7z archive (7z only)
+    fast_bytes: Optional[int] = None  # LZMA2 fast bytes, 5..273 (7z only)
 
 class UnzipReq(BaseModel):
     folder: str                 # directory under BASE_DIR where the archive resides
@@ -119,6 +662,14 @@ class UnzipReq(BaseModel):
     dest_dir: Optional[str] = None  # final folder name under OUT_DIR (optional)
     overwrite: str = "skip"     # "skip", "overwrite", or "rename"
 
+class UnzipBatchReq(BaseModel):
+    folder: str                 # directory under BASE_DIR where the archives reside
+    archives: list[str]         # archive names inside folder
+    entries: Optional[list[str]] = None  # only extract these paths (default: everything)
+    password: Optional[str] = None
+    dest_dir: Optional[str] = None  # folder under OUT_DIR; each archive lands in <dest_dir>/<stem>
+    overwrite: str = "skip"     # "skip", "overwrite", or "rename"
+
 
 # ---- Routes ----
 @app.get("/health")
@@ -133,20 +684,29 @@ def health():
 
 
 @app.post("/zip-folder")
-def zip_folder(req: ZipFolderReq, authorization: Optional[str] = Header(default=None)):
+async def zip_folder(req: ZipFolderReq, authorization: Optional[str] = Header(default=None)):
     _require_auth(authorization)
 
-    logging.info("zip request: folder=%r archive_name=%r recursive=%r format=%r",
-                 req.folder, req.archive_name, req.recursive, req.format)
+    log.info("zip request: folder=%r archive_name=%r recursive=%r format=%r level=%r",
+             req.folder, req.archive_name, req.recursive, req.format, req.level)
 
     src = _safe_path(req.folder)
-    if not src.exists() or not src.is_dir():
+    st = _stat(src)
+    if st is None or not stat.S_ISDIR(st.st_mode):
         raise HTTPException(status_code=404, detail=f"Folder not found: {src}")
 
-    out = _safe_out(req.archive_name)
     fmt = (req.format or "zip").lower()
     if fmt not in {"zip", "7z"}:
         raise HTTPException(status_code=400, detail="format must be 'zip' or '7z'")
+    if not 0 <= req.level <= 9:
+        raise HTTPException(status_code=400, detail="level must be between 0 and 9")
+    threads = req.threads or SEVENZ_THREADS
+    if threads < 1:
+        raise HTTPException(status_code=400, detail="threads must be >= 1")
+    if not 1 <= req.dict_mb <= 1536:
+        raise HTTPException(status_code=400, detail="dict_mb must be between 1 and 1536")
+    if req.fast_bytes is not None and not 5 <= req.fast_bytes <= 273:
+        raise HTTPException(status_code=400, detail="fast_bytes must be between 5 and 273")
 
     # 7z syntax: 7z a [options] <archive> <files...>
     # Run inside 'src' and add '.'; recursion with -r if requested.
@@ -154,6 +714,29 @@ def zip_folder(req: ZipFolderReq, authorization: Optional[str] = Header(default=
     tflag = "-t7z" if fmt == "7z" else "-tzip"
     options.append(tflag)
 
+    level = req.level
+    if req.store_only:
+        level = 0
+    elif req.auto_store or req.store_extensions:
+        exts = _INCOMPRESSIBLE_EXTS.union(
+            "." + e.lower().lstrip(".") for e in req.store_extensions
+        )
+        if await asyncio.to_thread(_mostly_incompressible, src, req.recursive, exts):
+            level = 0
+
+    # Compression is CPU-bound: pin the method and spread it over all cores.
+    # Level 0 just stores, which turns the job into plain disk I/O.
+    options += [f"-mx={level}", f"-mmt={threads}"]
+    if level == 0:
+        options.append("-m0=Copy" if fmt == "7z" else "-mm=Copy")
+    elif fmt == "7z":
+        # Larger dictionaries find more matches on big inputs at the cost of RAM.
+        options += ["-m0=lzma2", f"-md={req.dict_mb}m", f"-ms={'on' if req.solid else 'off'}", "-mmtf=on"]
+        if req.fast_bytes:
+            options.append(f"-mfb={req.fast_bytes}")
+    else:
+        options.append("-mm=Deflate")
+
     if req.password:
         # -p works for both formats; -mhe=on only applicable to 7z
         options.append(f"-p{req.password}")
@@ -163,88 +746,200 @@ def zip_folder(req: ZipFolderReq, authorization: Optional[str] = Header(default=
     if req.recursive:
         options.append("-r")
 
-    args = ["7z", "a"] + options + [str(out), "."]
+    media_type = "application/x-7z-compressed" if fmt == "7z" else "application/zip"
+    # archive_name only names the download; 7z never sees it, since it would
+    # parse a name like "-sdel" as a switch.
+    name = _download_name(req.archive_name)
 
-    logging.info("Running 7z (zip) with args: %s (cwd=%s)", args, src)
-    _run_7z(args, cwd=src)
+    # Every request builds into its own file, so concurrent requests for the same
+    # archive_name never add to or unlink each other's archive.
+    out = OUT_DIR / f".build-{uuid.uuid4().hex}.{fmt}"
+    args = ["7z", "a"] + _SEVENZ_QUIET + options + [str(out), "."]
 
-    media_type = "application/x-7z-compressed" if fmt == "7z" else "application/zip"
-    return FileResponse(str(out), filename=out.name, media_type=media_type)
+    log.info("Running 7z (zip) with args: %s (cwd=%s)", args, src)
+    try:
+        await _run_7z(args, cwd=src)
+    except Exception:
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(out)
+        raise
+
+    # The archive is only a transfer artefact: drop it once the body has been sent
+    # so OUT_DIR does not fill up with every archive ever requested.
+    # Handing FileResponse the stat up front spares it a threadpool hop + second stat().
+    return FileResponse(
+        str(out),
+        filename=name,
+        media_type=media_type,
+        stat_result=os.stat(out),
+        background=BackgroundTask(os.unlink, str(out)),
+    )
 
 
 @app.post("/unzip-archive")
-def unzip_archive(req: UnzipReq, authorization: Optional[str] = Header(default=None)):
+async def unzip_archive(
+    req: UnzipReq,
+    authorization: Optional[str] = Header(default=None),
+):
     _require_auth(authorization)
-    logging.info(
+    return await _unzip(req)
+
+
+async def _unzip(req: UnzipReq) -> dict:
+    """Extract one archive as described by req and return its manifest."""
+    log.info(
         "unzip request: folder=%r archive_name=%r dest_dir=%r overwrite=%r",
         req.folder, req.archive_name, req.dest_dir, req.overwrite
     )
 
-    # Source folder (where the archive is) must be inside BASE_DIR
-    src_folder = _safe_path(req.folder)
-    if not src_folder.exists() or not src_folder.is_dir():
-        raise HTTPException(status_code=404, detail=f"Source folder not found: {src_folder}")
-
-    archive_path = (src_folder / req.archive_name).resolve()
-    if not str(archive_path).startswith(str(BASE_DIR) + os.sep) and str(archive_path) != str(BASE_DIR):
-        raise HTTPException(status_code=400, detail=f"Archive path outside allowed base: {archive_path}")
-    if not archive_path.exists() or not archive_path.is_file():
-        raise HTTPException(status_code=404, detail=f"Archive file not found: {archive_path}")
+    # Archive (inside folder) must be inside BASE_DIR
+    archive_path, archive_st = _safe_archive(req.folder, req.archive_name)
 
     # ---- Decide final target folder (single level) ----
     archive_stem = archive_path.stem  # e.g. "invoices" from "invoices.zip"
-    final_dir = (OUT_DIR / (req.dest_dir or archive_stem)).resolve()
-    _ensure_under_out(final_dir)
-
-    # Overwrite policy at folder level
-    mode = (req.overwrite or "skip").lower()
-    if final_dir.exists():
-        if mode == "overwrite":
-            shutil.rmtree(final_dir)
-        elif mode == "rename":
-            final_dir = _unique_path(final_dir)
-        else:  # skip
-            raise HTTPException(status_code=409, detail=f"Destination exists: {final_dir}")
-
-    # ---- Extract to temp dir first ----
-    temp_dir = (OUT_DIR / f".extract-{archive_stem}-{uuid.uuid4().hex[:8]}").resolve()
-    _ensure_under_out(temp_dir)
-    temp_dir.mkdir(parents=True, exist_ok=True)
-
-    cmd = ["7z", "x", str(archive_path), f"-o{str(temp_dir)}", "-y"]
-    if req.password:
-        cmd.append(f"-p{req.password}")
+    final_dir = _safe_dest(req.dest_dir or archive_stem)
+
+    async with _overwrite_policy(final_dir, req.overwrite) as final_dir:
+        # ---- Peek at the layout so we can extract straight into place ----
+        # - single top-level dir named like final_dir: extract next to it, 7z recreates it
+        # - no single top-level dir: extract into final_dir itself
+        # - single top-level dir with another name: temp dir + one rename (below)
+        # Small archives skip the probe: the temp-dir route costs less for them than
+        # spawning a listing first.
+        direct = False
+        if archive_st.st_size >= _ROOT_PROBE_MIN_SIZE:
+            root = await _detect_single_root_dir(archive_path, req.password, archive_st)
+            direct = root is None or root == final_dir.name
+        # final_dir already exists (claimed by _overwrite_policy, which also removes
+        # it again if extraction fails).
+        if direct:
+            extract_to = final_dir if root is None else final_dir.parent
+            # Entries must still land inside final_dir, not just anywhere in extract_to.
+            await _extract_archive(archive_path, extract_to, req.password, root=final_dir)
+        else:
+            temp_dir = OUT_DIR / f".extract-{archive_stem}-{uuid.uuid4().hex[:8]}"
+            temp_dir.mkdir(parents=True, exist_ok=True)
+            try:
+                await _extract_archive(archive_path, temp_dir, req.password)
+                # ---- Normalize to a single folder level ----
+                await asyncio.to_thread(_normalize_extraction, temp_dir, final_dir)
+            except Exception:
+                await asyncio.to_thread(shutil.rmtree, temp_dir, ignore_errors=True)
+                raise
 
-    logging.info("Running 7z (unzip) with args: %s", cmd)
-    try:
-        _run_7z(cmd)
-    except HTTPException:
-        shutil.rmtree(temp_dir, ignore_errors=True)
-        raise
+    # Return a small manifest (top-level entries only)
+    top_entries = await asyncio.to_thread(_top_level_entries, final_dir)
 
-    # ---- Normalize to a single folder level ----
-    # If temp contains exactly one directory, use it as final_dir; else wrap all items into final_dir.
-    entries = list(temp_dir.iterdir())
-    if len(entries) == 1 and entries[0].is_dir():
-        # Move that single directory to final_dir (no extra nesting)
-        entries[0].replace(final_dir)
-    else:
-        final_dir.mkdir(parents=True, exist_ok=False)
-        for p in entries:
-            shutil.move(str(p), str(final_dir))
+    return {
+        "status": "ok",
+        "archive": str(archive_path),
+        "extracted_to": str(final_dir),
+        "entries_top_level": top_entries
+    }
 
-    # Cleanup temp directory
-    shutil.rmtree(temp_dir, ignore_errors=True)
 
-    # Return a small manifest (top-level entries only)
-    try:
-        top_entries = sorted([p.name for p in final_dir.iterdir()])
-    except Exception:
-        top_entries = []
+@app.post("/unzip-archives")
+async def unzip_archives(
+    reqs: list[UnzipReq],
+    authorization: Optional[str] = Header(default=None),
+):
+    """
+    Extract several independent archives concurrently (bounded by CPU count).
+    Returns one result per request, in order; failures are reported per item.
+    """
+    _require_auth(authorization)
+    sem = asyncio.Semaphore(CPU_COUNT)
+
+    async def one(r: UnzipReq) -> dict:
+        async with sem:
+            return await _unzip(r)
+
+    results = await asyncio.gather(*(one(r) for r in reqs), return_exceptions=True)
+
+    out = []
+    for r, res in zip(reqs, results):
+        if isinstance(res, HTTPException):
+            out.append({"status": "error", "archive_name": r.archive_name,
+                        "status_code": res.status_code, "detail": res.detail})
+        elif isinstance(res, Exception):
+            log.error("unzip of %r failed: %s", r.archive_name, res)
+            out.append({"status": "error", "archive_name": r.archive_name,
+                        "status_code": 500, "detail": str(res)})
+        else:
+            out.append(res)
+    return {"status": "ok", "results": out}
+
+
+@app.post("/unzip-batch")
+async def unzip_batch(
+    req: UnzipBatchReq,
+    authorization: Optional[str] = Header(default=None),
+):
+    _require_auth(authorization)
+    log.info(
+        "unzip batch request: folder=%r archives=%d entries=%s dest_dir=%r overwrite=%r",
+        req.folder, len(req.archives), len(req.entries) if req.entries else "all",
+        req.dest_dir, req.overwrite
+    )
+    if not req.archives:
+        raise HTTPException(status_code=400, detail="archives must not be empty")
+
+    archive_paths = list(dict.fromkeys(_safe_archive(req.folder, name)[0] for name in req.archives))
+    # Each archive gets <dest_dir>/<stem>; two archives sharing a stem (a.zip, a.7z)
+    # would silently merge into one folder.
+    by_stem = {}
+    for p in archive_paths:
+        if p.stem in by_stem:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Archives {by_stem[p.stem].name!r} and {p.name!r} would both extract to {p.stem!r}",
+            )
+        by_stem[p.stem] = p
+    # 7z expands * and ? in archive names (on the command line and in -ai lists alike)
+    listed = [p for p in archive_paths if not _WILDCARD_CHARS.intersection(str(p))]
+    wildcard_named = [p for p in archive_paths if _WILDCARD_CHARS.intersection(str(p))]
+
+    final_dir = _safe_dest(req.dest_dir or f"batch-{uuid.uuid4().hex[:8]}")
+    async with _overwrite_policy(final_dir, req.overwrite) as final_dir:
+        options = [*_SEVENZ_QUIET, "-scsUTF-8", "-y"]
+        if req.password:
+            options.append(f"-p{req.password}")
+        entry_args = []
+        list_files = []
+        try:
+            if req.entries:
+                list_files.append(_write_list_file(req.entries))
+                entry_args.append(f"@{list_files[-1]}")
+
+            if listed:
+                # One 7z run for the batch: -an/-ai@ reads archive names from a list file,
+                # @entries restricts what is extracted, and "-o<dir>/*" gives each archive its
+                # own subfolder. Solid blocks are decoded once per archive instead of once per call.
+                list_files.append(_write_list_file([str(p) for p in listed]))
+                cmd = ["7z", "x", *options, "-an", f"-ai@{list_files[-1]}",
+                       f"-o{final_dir}{os.sep}*", *entry_args]
+                log.info("Running 7z (unzip batch) with args: %s", cmd)
+                await _run_7z(cmd)
+
+            if wildcard_named:
+                # Names with wildcard characters can't be handed to 7z as such: open each
+                # through a plain-named symlink and give it an explicit output folder.
+                with tempfile.TemporaryDirectory() as tmp:
+                    for i, p in enumerate(wildcard_named):
+                        alias = os.path.join(tmp, f"{i}.arc")
+                        os.symlink(p, alias)
+                        cmd = ["7z", "x", *options, f"-o{final_dir / p.stem}", alias, *entry_args]
+                        log.info("Running 7z (unzip batch, %s) with args: %s", p.name, cmd)
+                        await _run_7z(cmd)
+        finally:
+            for lf in list_files:
+                os.unlink(lf)
+
+    top_entries = await asyncio.to_thread(_top_level_entries, final_dir)
 
     return {
         "status": "ok",
-        "archive": str(archive_path),
+        "archives": [str(p) for p in archive_paths],
         "extracted_to": str(final_dir),
-        "entries_top_level": top_entries[:200]
+        "entries_top_level": top_entries
     }